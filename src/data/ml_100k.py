@@ -6,11 +6,12 @@ from typing import Dict, Iterable
 from zipfile import ZipFile
 
 import dask.dataframe as dd
+import pandas as pd
 import requests
 import tensorflow as tf
 
 from logger import get_logger
-from tf_utils import dd_tfrecord, dd_create_categorical_column
+from tf_utils import dd_tfrecord, pd_create_categorical_column
 
 logger = get_logger(__name__)
 
@@ -128,11 +129,11 @@ def save_data(dfs: Dict[str, dd.DataFrame], save_dir: str = "data/ml-100k") -> N
         dd_tfrecord(df, str(Path(save_dir, name + ".tfrecord")))
 
 
-def build_categorical_columns(df: dd.DataFrame,
+def build_categorical_columns(df: pd.DataFrame,
                               feature_names: Iterable[str] = DATA_DEFAULT["feature_names"]) -> Iterable:
     # categorical columns
     columns_dict = {
-        col: dd_create_categorical_column(df, col)
+        col: pd_create_categorical_column(df, col)
         for col in DATA_DEFAULT["categorical_columns"]
     }
 
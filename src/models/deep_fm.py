@@ -3,8 +3,11 @@ import shutil
 import sys
 from typing import Dict
 
-import dask.dataframe as dd
+import numpy as np
+import pandas as pd
 import tensorflow as tf
+from tensorflow.contrib.compiler import jit
+from tensorflow.python.feature_column.feature_column import _LazyBuilder
 
 from src.data.ml_100k import DATA_DEFAULT, build_categorical_columns
 from src.logger import get_logger
@@ -26,49 +29,66 @@ def model_fn(features: Dict[str, tf.Tensor], labels: tf.Tensor, mode, params: Di
     activation_fn = params.get("activation", tf.nn.relu)
     dropout = params.get("dropout", 0)
     # training params
-    optimizer = params.get("optimizer", "Adam")
+    optimizer = params.get("optimizer", "LazyAdam")
     learning_rate = params.get("learning_rate", 0.001)
+    mixed_precision = params.get("mixed_precision", False)
+    # debug params
+    enable_summaries = params.get("enable_summaries", False)
 
-    # check params
+    # check params; dims and the combined column list are reused by all components
     categorical_dim = len(categorical_columns)
     numeric_dim = len(numeric_columns)
+    all_columns = categorical_columns + numeric_columns
     if (categorical_dim + numeric_dim) == 0:
         raise ValueError("At least 1 feature column of categorical_columns or numeric_columns must be specified.")
     if not (use_linear or use_mf or use_dnn):
         raise ValueError("At least 1 of linear, mf or dnn component must be used.")
 
-    logits = 0
+    component_logits = []
     if use_linear:
         with tf.variable_scope("linear"):
-            linear_logit = tf.feature_column.linear_model(features, categorical_columns + numeric_columns)
+            linear_logit = tf.feature_column.linear_model(features, all_columns)
             # [None, 1]
 
-            with tf.name_scope("linear"):
-                layer_summary(linear_logit)
-            logits += linear_logit
+            if enable_summaries:
+                with tf.name_scope("linear"):
+                    layer_summary(linear_logit)
+            component_logits.append(linear_logit)
             # [None, 1]
 
     if use_mf or use_dnn:
         with tf.variable_scope("input_layer"):
-            # categorical input
-            categorical_dim = len(categorical_columns)
+            # categorical input: one shared embedding table over all columns,
+            # offset so each column owns a contiguous slice of rows, and a
+            # single gather instead of one lookup subgraph per column
             if categorical_dim > 0:
-                embedding_columns = [tf.feature_column.embedding_column(col, embedding_size)
-                                     for col in categorical_columns]
-                embedding_inputs = tf.feature_column.input_layer(features, embedding_columns)
+                builder = _LazyBuilder(features)
+                num_buckets = [int(col._num_buckets) for col in categorical_columns]
+                offsets = np.cumsum([0] + num_buckets[:-1])
+                id_tensors = []
+                for col, offset in zip(categorical_columns, offsets):
+                    # each feature holds one value per example, so the sparse
+                    # ids densify to a [None, 1] column of table-local indices
+                    ids = tf.sparse.to_dense(col._get_sparse_tensors(builder).id_tensor)
+                    id_tensors.append(ids + offset)
+                embeddings = tf.get_variable("embeddings", [sum(num_buckets), embedding_size])
+                # [total_buckets, embedding_size]
+                embedding_inputs = tf.reshape(
+                    tf.nn.embedding_lookup(embeddings, tf.concat(id_tensors, 1)),
+                    [-1, categorical_dim * embedding_size])
                 # [None, c_d * embedding_size]
                 input_layer = embedding_inputs
                 # [None, c_d * embedding_size]
 
             # numeric input
-            numeric_dim = len(numeric_columns)
             if numeric_dim > 0:
-                numeric_inputs = tf.expand_dims(tf.feature_column.input_layer(features, numeric_columns), -1)
-                # [None, n_d, 1]
-                numeric_embeddings = tf.get_variable("numeric_embeddings", [1, numeric_dim, embedding_size])
-                # [1, n_d, embedding_size]
-                numeric_embedding_inputs = tf.reshape(numeric_embeddings * numeric_inputs,
-                                                      [-1, numeric_dim * embedding_size])
+                numeric_inputs = tf.feature_column.input_layer(features, numeric_columns)
+                # [None, n_d]
+                numeric_embeddings = tf.get_variable("numeric_embeddings", [numeric_dim, embedding_size])
+                # [n_d, embedding_size]
+                numeric_embedding_inputs = tf.reshape(
+                    tf.einsum("bn,nk->bnk", numeric_inputs, numeric_embeddings),
+                    [-1, numeric_dim * embedding_size])
                 # [None, n_d * embedding_size]
                 input_layer = numeric_embedding_inputs
                 # [None, n_d * embedding_size]
@@ -82,16 +102,19 @@ def model_fn(features: Dict[str, tf.Tensor], labels: tf.Tensor, mode, params: Di
                 # reshape flat embedding input layer to matrix
                 embedding_mat = tf.reshape(input_layer, [-1, categorical_dim + numeric_dim, embedding_size])
                 # [None, d, embedding_size]
-                sum_square = tf.square(tf.reduce_sum(embedding_mat, 1))
-                # [None, embedding_size]
-                square_sum = tf.reduce_sum(tf.square(embedding_mat), 1)
+                embedding_sum = tf.reduce_sum(embedding_mat, 1)
                 # [None, embedding_size]
 
                 with tf.name_scope("logits"):
-                    mf_logit = 0.5 * tf.reduce_sum(sum_square - square_sum, 1, keepdims=True)
+                    # fused sum-square minus square-sum: single expression so the
+                    # elementwise ops fuse instead of materialising both intermediates
+                    mf_logit = 0.5 * tf.reduce_sum(
+                        embedding_sum * embedding_sum - tf.reduce_sum(embedding_mat * embedding_mat, 1),
+                        1, keepdims=True)
                     # [None, 1]
-                    layer_summary(mf_logit)
-                logits += mf_logit
+                    if enable_summaries:
+                        layer_summary(mf_logit)
+                component_logits.append(mf_logit)
                 # [None, 1]
 
         if use_dnn:
@@ -99,24 +122,33 @@ def model_fn(features: Dict[str, tf.Tensor], labels: tf.Tensor, mode, params: Di
                 net = input_layer
                 # [None, d * embedding_size]
 
-                for i, hidden_size in enumerate(hidden_units):
-                    with tf.variable_scope("hiddenlayer_%s" % i):
-                        net = tf.layers.dense(net, hidden_size, activation=activation_fn)
-                        # [None, hidden_size]
-                        if dropout > 0 and mode == tf.estimator.ModeKeys.TRAIN:
-                            net = tf.layers.dropout(net, rate=dropout, training=True)
+                # compile the dense/activation/dropout chain into fused xla
+                # kernels, independent of the session-level jit setting
+                with jit.experimental_jit_scope():
+                    for i, hidden_size in enumerate(hidden_units):
+                        with tf.variable_scope("hiddenlayer_%s" % i):
+                            net = tf.layers.dense(net, hidden_size, activation=activation_fn)
                             # [None, hidden_size]
-                        layer_summary(net)
+                            if dropout > 0 and mode == tf.estimator.ModeKeys.TRAIN:
+                                net = tf.layers.dropout(net, rate=dropout, training=True)
+                                # [None, hidden_size]
+                            if enable_summaries:
+                                layer_summary(net)
 
-                with tf.variable_scope('logits'):
-                    dnn_logit = tf.layers.dense(net, 1)
-                    # [None, 1]
-                    layer_summary(dnn_logit)
-                logits += dnn_logit
+                    with tf.variable_scope('logits'):
+                        dnn_logit = tf.layers.dense(net, 1)
+                        # [None, 1]
+                        if enable_summaries:
+                            layer_summary(dnn_logit)
+                component_logits.append(dnn_logit)
                 # [None, 1]
 
     with tf.name_scope("deep_fm/logits"):
-        layer_summary(logits)
+        # sum the component logits in a single add_n instead of chained adds
+        logits = tf.add_n(component_logits)
+        # [None, 1]
+        if enable_summaries:
+            layer_summary(logits)
 
     # prediction
     predictions = get_binary_predictions(logits)
@@ -130,7 +162,7 @@ def model_fn(features: Dict[str, tf.Tensor], labels: tf.Tensor, mode, params: Di
         return tf.estimator.EstimatorSpec(mode=mode, loss=losses["loss"], eval_metric_ops=metric_ops)
 
     # training
-    train_op = get_train_op(losses["loss"], optimizer, learning_rate)
+    train_op = get_train_op(losses["loss"], optimizer, learning_rate, mixed_precision=mixed_precision)
     tf.summary.scalar("average_loss", losses["average_loss"])
     if mode == tf.estimator.ModeKeys.TRAIN:
         return tf.estimator.EstimatorSpec(mode=mode, loss=losses["loss"], train_op=train_op)
@@ -138,15 +170,19 @@ def model_fn(features: Dict[str, tf.Tensor], labels: tf.Tensor, mode, params: Di
 
 def train_main(args):
     # define feature columns
-    df = dd.read_csv(args.train_csv, dtype=DATA_DEFAULT["dtype"]).persist()
+    df = pd.read_csv(args.train_csv, dtype=DATA_DEFAULT["dtype"])
     categorical_columns = build_categorical_columns(df, feature_names=DATA_DEFAULT["feature_names"])
 
     # clean up model directory
     shutil.rmtree(args.model_dir, ignore_errors=True)
+    # enable XLA jit compilation to fuse the elementwise fm and dnn ops
+    session_config = tf.ConfigProto(graph_options=tf.GraphOptions(
+        optimizer_options=tf.OptimizerOptions(global_jit_level=tf.OptimizerOptions.ON_1)))
     # define model
     model = tf.estimator.Estimator(
         model_fn,
         args.model_dir,
+        config=tf.estimator.RunConfig(session_config=session_config),
         params={
             "categorical_columns": categorical_columns,
             "use_linear": not args.exclude_linear,
@@ -155,22 +191,31 @@ def train_main(args):
             "embedding_size": args.embedding_size,
             "hidden_units": args.hidden_units,
             "dropout": args.dropout,
+            "mixed_precision": args.mixed_precision,
+            "enable_summaries": args.enable_summaries,
         }
     )
 
     logger.debug("model training started.")
-    for n in range(args.num_epochs):
-        # train model
-        model.train(
-            input_fn=lambda: tf_csv_dataset(args.train_csv, DATA_DEFAULT["label"],
-                                            shuffle=True, batch_size=args.batch_size)
-        )
-        # evaluate model
-        results = model.evaluate(
-            input_fn=lambda: tf_csv_dataset(args.test_csv, DATA_DEFAULT["label"],
-                                            batch_size=args.batch_size)
-        )
-        logger.info("epoch %s: %s.", n, results)
+    # train model; the dataset repeats num_epochs times over the cached csv
+    model.train(
+        input_fn=lambda: tf_csv_dataset(args.train_csv, DATA_DEFAULT["label"],
+                                        shuffle=True, batch_size=args.batch_size,
+                                        num_epochs=args.num_epochs)
+    )
+    # evaluate model
+    results = model.evaluate(
+        input_fn=lambda: tf_csv_dataset(args.test_csv, DATA_DEFAULT["label"],
+                                        batch_size=args.batch_size)
+    )
+    logger.info("training done: %s.", results)
+
+    # export the predict graph for serving and offline aot compilation;
+    # the export carries none of the train-only ops (dropout, summaries)
+    feature_spec = tf.feature_column.make_parse_example_spec(categorical_columns)
+    serving_input_receiver_fn = tf.estimator.export.build_parsing_serving_input_receiver_fn(feature_spec)
+    export_dir = model.export_saved_model(args.export_dir, serving_input_receiver_fn)
+    logger.info("saved model exported: %s.", export_dir)
 
 
 if __name__ == '__main__':
@@ -181,6 +226,8 @@ if __name__ == '__main__':
                         help="path to the test csv data (default: %(default)s)")
     parser.add_argument("--model-dir", default="checkpoints/deep_fm",
                         help="model directory (default: %(default)s)")
+    parser.add_argument("--export-dir", default="checkpoints/deep_fm/export",
+                        help="saved model export directory (default: %(default)s)")
     parser.add_argument("--exclude-linear", action="store_true",
                         help="flag to exclude linear component (default: %(default)s)")
     parser.add_argument("--exclude-mf", action="store_true",
@@ -193,6 +240,10 @@ if __name__ == '__main__':
                         help="hidden layer specification (default: %(default)s)")
     parser.add_argument("--dropout", type=float, default=0.1,
                         help="dropout rate (default: %(default)s)")
+    parser.add_argument("--mixed-precision", action="store_true",
+                        help="flag to train the dense towers in fp16 (default: %(default)s)")
+    parser.add_argument("--enable-summaries", action="store_true",
+                        help="flag to emit per-layer tensorboard summaries (default: %(default)s)")
     parser.add_argument("--batch-size", type=int, default=32,
                         help="batch size (default: %(default)s)")
     parser.add_argument("--num-epochs", type=int, default=16,
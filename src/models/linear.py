@@ -2,7 +2,7 @@ from argparse import ArgumentParser
 import shutil
 import sys
 
-import dask.dataframe as dd
+import pandas as pd
 import tensorflow as tf
 
 from src.data.ml_100k import DATA_DEFAULT, build_categorical_columns
@@ -12,35 +12,36 @@ from src.tf_utils import tf_csv_dataset
 
 def train_main(args):
     # define feature columns
-    df = dd.read_csv(args.train_csv, dtype=DATA_DEFAULT["dtype"]).persist()
+    df = pd.read_csv(args.train_csv, dtype=DATA_DEFAULT["dtype"])
     categorical_columns = build_categorical_columns(df, feature_names=DATA_DEFAULT["feature_names"])
-    indicator_columns = [tf.feature_column.indicator_column(col)
-                         for col in categorical_columns]
 
     # clean up model directory
     shutil.rmtree(args.model_dir, ignore_errors=True)
-    # define model
+    # define model; categorical columns are passed directly so the linear model
+    # uses sparse lookups instead of materialising dense one-hot indicators
     model = tf.estimator.LinearClassifier(
-        feature_columns=indicator_columns,
+        feature_columns=categorical_columns,
         model_dir=args.model_dir,
+        optimizer=tf.train.FtrlOptimizer(learning_rate=0.1,
+                                         l1_regularization_strength=1.0),
     )
 
     logger.debug("model training started.")
-    for n in range(args.num_epochs):
-        # train model
-        model.train(
-            input_fn=lambda: tf_csv_dataset(args.train_csv,
-                                            DATA_DEFAULT["label"],
-                                            shuffle=True,
-                                            batch_size=args.batch_size)
-        )
-        # evaluate model
-        results = model.evaluate(
-            input_fn=lambda: tf_csv_dataset(args.test_csv,
-                                            DATA_DEFAULT["label"],
-                                            batch_size=args.batch_size)
-        )
-        logger.info("epoch %s: %s.", n, results)
+    # train model; the dataset repeats num_epochs times over the cached csv
+    model.train(
+        input_fn=lambda: tf_csv_dataset(args.train_csv,
+                                        DATA_DEFAULT["label"],
+                                        shuffle=True,
+                                        batch_size=args.batch_size,
+                                        num_epochs=args.num_epochs)
+    )
+    # evaluate model
+    results = model.evaluate(
+        input_fn=lambda: tf_csv_dataset(args.test_csv,
+                                        DATA_DEFAULT["label"],
+                                        batch_size=args.batch_size)
+    )
+    logger.info("training done: %s.", results)
 
 
 if __name__ == '__main__':
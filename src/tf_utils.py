@@ -1,7 +1,9 @@
+import os
 from typing import Dict
 
 import dask.dataframe as dd
 import numpy as np
+import pandas as pd
 import tensorflow as tf
 
 from logger import get_logger
@@ -42,25 +44,41 @@ def dd_tfrecord(df: dd.DataFrame, tfrecord_path: str) -> None:
 
 
 def tf_csv_dataset(csv_path: str, label_col: str, col_defaults: Dict = {},
-                   shuffle: bool = False, batch_size: int = 32) -> tf.data.Dataset:
-    df = dd.read_csv(csv_path)
+                   shuffle: bool = False, batch_size: int = 32,
+                   num_epochs: int = 1) -> tf.data.Dataset:
+    # csv_path may be a single file or a glob over pre-split shards
+    file_paths = sorted(tf.gfile.Glob(csv_path))
+    df = pd.read_csv(file_paths[0], nrows=1000)  # sample rows to infer column types
     # use col_defaults if specified for col, else use defaults base on col type
     type_defaults = {np.int64: 0, np.float64: 0.0, np.object_: ""}
     record_defaults = [[col_defaults.get(col_name, type_defaults.get(col_type.type, ""))]
                        for col_name, col_type in df.dtypes.items()]
 
-    def parse_csv(value):
-        columns = tf.decode_csv(value, record_defaults)
-        features = dict(zip(df.columns.tolist(), columns))
+    column_names = df.columns.tolist()
+
+    def to_features(*columns):
+        features = dict(zip(column_names, columns))
         label = features[label_col]
         return features, label
 
-    # read, parse, shuffle and batch dataset
-    dataset = tf.data.TextLineDataset(csv_path).skip(1)  # skip header
+    # read shards in parallel, parsing records in c++ without per-line graph round trips
+    files = tf.data.Dataset.list_files(file_paths, shuffle=shuffle)
+    dataset = files.interleave(
+        lambda file_path: tf.data.experimental.CsvDataset(file_path, record_defaults, header=True),
+        cycle_length=min(len(file_paths), os.cpu_count() or 1),
+        num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    # cache parsed records before shuffle so repeated epochs replay from memory with a fresh shuffle
+    dataset = dataset.cache()
     if shuffle:
-        dataset = dataset.shuffle(buffer_size=1024)
-    dataset = dataset.map(parse_csv, num_parallel_calls=8)
-    dataset = dataset.batch(batch_size)
+        # shards are already shuffled at the file level by list_files, so a
+        # modest buffer over the cached records is enough; each epoch reshuffles
+        dataset = dataset.shuffle(buffer_size=8192, reshuffle_each_iteration=True)
+    dataset = dataset.repeat(num_epochs)
+    # fused map + batch: restructure parsed columns into feature dicts per batch
+    dataset = dataset.apply(tf.data.experimental.map_and_batch(
+        to_features, batch_size, num_parallel_calls=tf.data.experimental.AUTOTUNE))
+    # overlap input parsing with training on the previous batch
+    dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
     return dataset
 
 
@@ -73,6 +91,24 @@ def dd_create_categorical_column(df: dd.DataFrame, col: str, default_value: int
     )
 
 
+def pd_create_categorical_column(df: pd.DataFrame, col: str, default_value: int = -1, num_oov_buckets: int = 1):
+    values = df[col].unique()
+    # non-negative integer features index the table directly: a pure gather
+    # with no runtime hash-table lookup; unseen values fall back to bucket 0
+    if np.issubdtype(values.dtype, np.integer) and values.min() >= 0:
+        return tf.feature_column.categorical_column_with_identity(
+            col,
+            num_buckets=int(values.max()) + 1,
+            default_value=0
+        )
+    return tf.feature_column.categorical_column_with_vocabulary_list(
+        col,
+        np.sort(values).tolist(),
+        default_value=default_value,
+        num_oov_buckets=num_oov_buckets
+    )
+
+
 def layer_summary(value: tf.Tensor) -> None:
     tf.summary.scalar("fraction_of_zero_values", tf.nn.zero_fraction(value))
     tf.summary.histogram("activation", value)
@@ -127,16 +163,23 @@ def get_binary_metric_ops(labels: tf.Tensor, predictions: Dict[str, tf.Tensor],
     return metrics
 
 
-def get_train_op(loss: tf.Tensor, optimizer_name: str = "Adam", learning_rate: float = 0.001) -> tf.Operation:
+def get_train_op(loss: tf.Tensor, optimizer_name: str = "Adam", learning_rate: float = 0.001,
+                 mixed_precision: bool = False) -> tf.Operation:
     optimizer_classes = {
         "Adagrad": tf.train.AdagradOptimizer,
         "Adam": tf.train.AdamOptimizer,
         "Ftrl": tf.train.FtrlOptimizer,
+        # lazy adam only updates the embedding rows touched by the batch
+        "LazyAdam": tf.contrib.opt.LazyAdamOptimizer,
         "RMSProp": tf.train.RMSPropOptimizer,
         "SGD": tf.train.GradientDescentOptimizer,
     }
 
     with tf.name_scope("train"):
         optimizer = optimizer_classes[optimizer_name](learning_rate=learning_rate)
+        if mixed_precision:
+            # rewrite the graph to run the dense math in fp16 with automatic
+            # loss scaling; variables and the loss itself stay fp32
+            optimizer = tf.train.experimental.enable_mixed_precision_graph_rewrite(optimizer)
         train_op = optimizer.minimize(loss, global_step=tf.train.get_global_step())
     return train_op